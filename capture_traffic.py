@@ -5,29 +5,128 @@ Captures traffic images from Singapore LTA DataMall API at scheduled times
 """
 
 import os
+import re
 import json
+import shutil
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+try:
+    import orjson
+except ImportError:  # Fall back to the (slower) stdlib encoder
+    orjson = None
 
 # Configuration
 LTA_API_KEY = os.environ.get('LTA_API_KEY', '')
 API_URL = 'https://datamall2.mytransport.sg/ltaodataservice/Traffic-Imagesv2'
+# Set to 1 to fall back to matching cameras by location when none of the camera IDs are found
+LTA_LOCATION_FALLBACK = os.environ.get('LTA_LOCATION_FALLBACK', '') == '1'
 OUTPUT_DIR = Path('traffic_images')
 
+# Singapore timezone (UTC+8)
+SGT = timezone(timedelta(hours=8))
+
 # Checkpoint Camera IDs (from LTA DataMall)
 # Monitoring both Tuas and Woodlands checkpoints
-CHECKPOINT_CAMERA_IDS = [
+CHECKPOINT_CAMERA_IDS = frozenset({
     '2701',  # Woodlands Causeway (Towards Johor)
     '2702',  # Woodlands Checkpoint
     '4703',  # Tuas Second Link
     '4713',  # Tuas Checkpoint
  #   '4714',  # AYE (Tuas) - Near West Coast Walk
-]
+})
+
+# Fallback location match used when none of the camera IDs are found
+CHECKPOINT_LOCATION_RE = re.compile(r'tuas|woodlands|causeway', re.IGNORECASE)
+
+# Maximum number of images downloaded in parallel (kept small to be polite
+# to the image CDN; also sizes the HTTP connection pool)
+MAX_DOWNLOAD_WORKERS = 4
+
+# Serialises console output from download threads
+print_lock = threading.Lock()
+
+# Shared HTTP session so the API call and image downloads reuse pooled
+# keep-alive connections instead of a new TCP+TLS handshake per request
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=MAX_DOWNLOAD_WORKERS,
+    pool_maxsize=MAX_DOWNLOAD_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+))
+
+# LTA refreshes camera data every 1-5 mins, so reuse a fetched camera list
+# for a short while (in-process, and on disk for back-to-back runs)
+API_CACHE_TTL = 60  # seconds
+_api_cache = {}
+
+def load_cached_cameras():
+    """Return the cached camera list if still fresh, else None"""
+    
+    cached = _api_cache.get('cameras')
+    if cached and time.monotonic() - cached[0] < API_CACHE_TTL:
+        return cached[1]
+    
+    cache_file = OUTPUT_DIR / '.cache' / 'cameras.json'
+    try:
+        if time.time() - cache_file.stat().st_mtime < API_CACHE_TTL:
+            with open(cache_file) as f:
+                cameras = json.load(f)
+            _api_cache['cameras'] = (time.monotonic(), cameras)
+            return cameras
+    except (OSError, ValueError):
+        pass
+    
+    return None
+
+def save_cached_cameras(cameras):
+    """Store the camera list in the in-process and on-disk caches"""
+    
+    _api_cache['cameras'] = (time.monotonic(), cameras)
+    
+    cache_file = OUTPUT_DIR / '.cache' / 'cameras.json'
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        write_json(cache_file, cameras)
+    except OSError as e:
+        print(f"  Warning: Could not write API cache: {e}")
+
+def write_json(path, obj):
+    """Atomically write obj to path as 2-space indented JSON"""
+    
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + '.part')
+    try:
+        if orjson is not None:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            with open(tmp_path, 'w') as f:
+                json.dump(obj, indent=2, fp=f)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 def get_traffic_images():
     """Fetch traffic images from LTA DataMall API"""
     
+    cameras = load_cached_cameras()
+    if cameras:
+        print(f"✓ Using {len(cameras)} cached cameras (fetched < {API_CACHE_TTL}s ago)")
+        return cameras
+    
+    # Sent only to the API, not set on SESSION, so the key never reaches the image host
     headers = {
         'AccountKey': LTA_API_KEY,
         'accept': 'application/json'
@@ -35,61 +134,128 @@ def get_traffic_images():
     
     try:
         print("Fetching camera data from LTA API...")
-        response = requests.get(API_URL, headers=headers, timeout=30)
+        response = SESSION.get(API_URL, headers=headers, timeout=30)
         response.raise_for_status()
         
         data = response.json()
         cameras = data.get('value', [])
         print(f"✓ Retrieved {len(cameras)} cameras from API")
+        if cameras:
+            save_cached_cameras(cameras)
         return cameras
     
     except requests.exceptions.RequestException as e:
         print(f"✗ Error fetching data from API: {e}")
         return []
 
-def download_image(image_url, save_path):
-    """Download image from URL and save to file"""
+def link_expired(image_url):
+    """Check whether a pre-signed image link has already expired
+    
+    The links are S3 pre-signed GET URLs, so a HEAD probe would fail the
+    signature check; the expiry is read from the X-Amz-Date/X-Amz-Expires
+    query parameters instead. Links without them are assumed valid.
+    """
     
+    query = parse_qs(urlsplit(image_url).query)
     try:
-        print(f"  Downloading from: {image_url[:80]}...")
-        response = requests.get(image_url, timeout=30)
-        response.raise_for_status()
+        signed_at = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+        expires_in = int(query['X-Amz-Expires'][0])
+    except (KeyError, IndexError, ValueError):
+        return False
+    
+    return datetime.now(timezone.utc) >= signed_at + timedelta(seconds=expires_in)
+
+def fetch_image(image_url, save_path, log):
+    """Download image from URL and save to file, appending progress messages to log"""
+    
+    tmp_path = save_path.with_suffix(save_path.suffix + '.part')
+    
+    try:
+        log.append(f"  Downloading from: {image_url[:80]}...")
+        response = SESSION.get(image_url, timeout=30, stream=True)
         
-        # Verify we got actual image data
-        content_type = response.headers.get('content-type', '')
-        if 'image' not in content_type.lower():
-            print(f"  ✗ Warning: Response is not an image (content-type: {content_type})")
-            return False
+        # Stream the body straight to disk instead of buffering it in memory
+        with response:
+            response.raise_for_status()
+            
+            # Verify we got actual image data
+            content_type = response.headers.get('content-type', '')
+            if 'image' not in content_type.lower():
+                log.append(f"  ✗ Warning: Response is not an image (content-type: {content_type})")
+                return False
+            
+            # Verify content size from the header before any body bytes are read
+            # (a missing or malformed Content-Length is treated as unknown)
+            try:
+                content_length = int(response.headers.get('content-length', 0))
+            except ValueError:
+                content_length = 0
+            if 0 < content_length < 1000:  # Images should be at least 1KB
+                log.append(f"  ✗ Warning: Image too small ({content_length} bytes)")
+                return False
+            
+            # Write to a temporary file first so an interrupted run never
+            # leaves a truncated JPEG under the final name
+            response.raw.decode_content = True
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=64 * 1024)
+                written = f.tell()
+                f.flush()
+                os.fsync(f.fileno())
+            
+            # A body shorter than the advertised length means the transfer was cut off
+            if content_length and not response.headers.get('content-encoding') and written != content_length:
+                log.append(f"  ✗ Warning: Incomplete image ({written:,} of {content_length:,} bytes)")
+                return False
         
-        # Verify content size
-        content_length = len(response.content)
-        if content_length < 1000:  # Images should be at least 1KB
-            print(f"  ✗ Warning: Image too small ({content_length} bytes)")
+        # Verify file was written (size is re-checked here for chunked
+        # responses that carried no Content-Length)
+        if written == 0:
+            log.append(f"  ✗ Failed to write file: {save_path}")
             return False
-        
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
-        
-        # Verify file was written
-        if save_path.exists() and save_path.stat().st_size > 0:
-            print(f"  ✓ Saved: {save_path.name} ({content_length:,} bytes)")
-            return True
-        else:
-            print(f"  ✗ Failed to write file: {save_path}")
+        if written < 1000:
+            log.append(f"  ✗ Warning: Image too small ({written} bytes)")
             return False
+        
+        os.replace(tmp_path, save_path)
+        log.append(f"  ✓ Saved: {save_path.name} ({written:,} bytes)")
+        return True
     
     except requests.exceptions.Timeout:
-        print(f"  ✗ Timeout downloading image")
+        log.append(f"  ✗ Timeout downloading image")
         return False
     except requests.exceptions.RequestException as e:
-        print(f"  ✗ Failed to download: {str(e)[:100]}")
+        log.append(f"  ✗ Failed to download: {str(e)[:100]}")
         return False
     except Exception as e:
-        print(f"  ✗ Unexpected error: {str(e)[:100]}")
+        log.append(f"  ✗ Unexpected error: {str(e)[:100]}")
         return False
+    finally:
+        # Discard any partial download that was not moved into place
+        tmp_path.unlink(missing_ok=True)
+
+def download_image(image_url, save_path, camera_id, location):
+    """Download one camera's image, printing its log lines as a single block"""
+    
+    # Buffer this camera's log lines so parallel downloads don't interleave
+    log = [f"\nCamera {camera_id}: {location}"]
+    
+    downloaded = fetch_image(image_url, save_path, log)
+    if not downloaded:
+        log.append(f"  ✗ Skipping camera {camera_id} - download failed")
+    
+    with print_lock:
+        print("\n".join(log))
+    
+    return downloaded
 
 def capture_checkpoint_cameras():
-    """Main function to capture checkpoint traffic images"""
+    """Main function to capture checkpoint traffic images
+    
+    Returns the future generating summary.json/README.md (or None if nothing
+    was captured); callers should call result() on it before exiting so a
+    failed summary still fails the run.
+    """
     
     if not LTA_API_KEY:
         print("ERROR: LTA_API_KEY environment variable not set!")
@@ -97,18 +263,15 @@ def capture_checkpoint_cameras():
         return
     
     # Create output directory structure
-    # Use Singapore timezone (UTC+8)
-    singapore_tz = timezone(timedelta(hours=8))
-    now = datetime.now(singapore_tz)
-    date_folder = now.strftime('%Y-%m-%d')
-    time_str = now.strftime('%H-%M-%S')
+    now = datetime.now(SGT)
+    date_folder, time_str = now.strftime('%Y-%m-%d %H-%M-%S').split(' ')
     
     daily_dir = OUTPUT_DIR / date_folder
     daily_dir.mkdir(parents=True, exist_ok=True)
     
     print(f"\n{'='*60}")
     print(f"Singapore Checkpoint Traffic Capture")
-    print(f"Date/Time (SGT): {now.strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Date/Time (SGT): {date_folder} {time_str.replace('-', ':')}")
     print(f"{'='*60}\n")
     
     # Fetch all camera data
@@ -121,14 +284,18 @@ def capture_checkpoint_cameras():
     # Filter for checkpoint cameras
     checkpoint_cameras = [cam for cam in cameras if cam.get('CameraID') in CHECKPOINT_CAMERA_IDS]
     
+    missing_ids = CHECKPOINT_CAMERA_IDS.difference(cam.get('CameraID') for cam in checkpoint_cameras)
+    for camera_id in sorted(missing_ids):
+        print(f"Warning: Camera {camera_id} not found in API response")
+    
     if not checkpoint_cameras:
         print(f"Warning: No checkpoint cameras found with specified IDs.")
-        print(f"Searching for checkpoint cameras by location...")
-        # Fallback: search by location name
-        checkpoint_cameras = [cam for cam in cameras 
-                            if any(keyword in cam.get('Location', '').lower() 
-                                  for keyword in ['tuas', 'woodlands', 'causeway'])]
-        print(f"Found {len(checkpoint_cameras)} cameras by location")
+        # Fallback: search by location name (opt-in, since camera IDs are stable)
+        if LTA_LOCATION_FALLBACK:
+            print(f"Searching for checkpoint cameras by location...")
+            checkpoint_cameras = [cam for cam in cameras 
+                                if CHECKPOINT_LOCATION_RE.search(cam.get('Location') or '')]
+            print(f"Found {len(checkpoint_cameras)} cameras by location")
     
     metadata = {
         'timestamp': now.isoformat(),
@@ -141,39 +308,71 @@ def capture_checkpoint_cameras():
     successful_downloads = 0
     failed_downloads = 0
     
-    for camera in checkpoint_cameras:
-        camera_id = camera.get('CameraID')
-        image_url = camera.get('ImageLink')
-        location = camera.get('Location', 'Unknown')
-        
-        print(f"\nCamera {camera_id}: {location}")
-        
-        if image_url:
-            # Save image with date and timestamp
-            filename = f"camera_{camera_id}_{date_folder}_{time_str}.jpg"
-            save_path = daily_dir / filename
+    # Download all images in parallel (LTA image links expire after 5 mins).
+    # A small thread pool over the pooled SESSION already overlaps these few
+    # blocking fetches, so there is no need for an asyncio/aiohttp stack.
+    downloads = []
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_DOWNLOAD_WORKERS, len(checkpoint_cameras)))) as executor:
+        try:
+            for camera in checkpoint_cameras:
+                camera_id = camera.get('CameraID')
+                image_url = camera.get('ImageLink')
+                location = camera.get('Location', 'Unknown')
+                
+                if image_url and not link_expired(image_url):
+                    # Save image with date and timestamp
+                    filename = f"camera_{camera_id}_{date_folder}_{time_str}.jpg"
+                    save_path = daily_dir / filename
+                    future = executor.submit(download_image, image_url, save_path, camera_id, location)
+                    downloads.append((camera, filename, future))
+                elif image_url:
+                    # Skip dead links up front rather than waiting on a 403
+                    with print_lock:
+                        print(f"\nCamera {camera_id}: {location}")
+                        print(f"  ✗ Image link has expired for camera {camera_id}")
+                    failed_downloads += 1
+                else:
+                    with print_lock:
+                        print(f"\nCamera {camera_id}: {location}")
+                        print(f"  ✗ No image URL available for camera {camera_id}")
+                    failed_downloads += 1
             
-            if download_image(image_url, save_path):
-                metadata['cameras'].append({
-                    'camera_id': camera_id,
-                    'location': location,
-                    'filename': filename,
-                    'image_url': image_url,
-                    'latitude': camera.get('Latitude'),
-                    'longitude': camera.get('Longitude')
-                })
-                successful_downloads += 1
-            else:
-                print(f"  ✗ Skipping camera {camera_id} - download failed")
-                failed_downloads += 1
-        else:
-            print(f"  ✗ No image URL available for camera {camera_id}")
-            failed_downloads += 1
+            results = {future: (camera, filename) for camera, filename, future in downloads}
+            for future in as_completed(results):
+                camera, filename = results[future]
+                camera_id = camera.get('CameraID')
+                
+                if future.result():
+                    metadata['cameras'].append({
+                        'camera_id': camera_id,
+                        'location': camera.get('Location', 'Unknown'),
+                        'filename': filename,
+                        'image_url': camera.get('ImageLink'),
+                        'latitude': camera.get('Latitude'),
+                        'longitude': camera.get('Longitude')
+                    })
+                    successful_downloads += 1
+                else:
+                    failed_downloads += 1
+        
+        except BaseException:
+            # Like a task group: on Ctrl+C or a fatal error, cancel the queued
+            # downloads instead of letting them all run to completion
+            executor.shutdown(cancel_futures=True)
+            raise
+    
+    # Keep metadata in API order regardless of download completion order
+    camera_order = {camera.get('CameraID'): i for i, camera in enumerate(checkpoint_cameras)}
+    metadata['cameras'].sort(key=lambda c: camera_order[c['camera_id']])
     
     # Save metadata
     metadata_file = daily_dir / f"metadata_{date_folder}_{time_str}.json"
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata, indent=2, fp=f)
+    write_json(metadata_file, metadata)
+    
+    # Generate summary report in the background while the run summary is printed
+    summary_executor = ThreadPoolExecutor(max_workers=1)
+    summary_future = summary_executor.submit(generate_summary, date_folder)
+    summary_executor.shutdown(wait=False)
     
     print(f"\n{'='*60}")
     print(f"Summary:")
@@ -191,49 +390,92 @@ def capture_checkpoint_cameras():
     
     print(f"{'='*60}\n")
     
-    # Generate summary report
-    generate_summary()
+    return summary_future
+
+def scan_date_dir(date_dir):
+    """Count the captures and images stored in one date folder"""
+    
+    # Single os.scandir pass; no Path objects or glob pattern matching
+    captures = images = 0
+    with os.scandir(date_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith('metadata_') and name.endswith('.json'):
+                captures += 1
+            elif name.startswith('camera_') and name.endswith('.jpg'):
+                images += 1
+    
+    return {
+        'date': date_dir.name,
+        'captures': captures,
+        'images': images
+    }
+
+def load_summary_days():
+    """Load the per-day entries from an existing summary.json, or None if missing/corrupt"""
+    
+    summary_file = OUTPUT_DIR / 'summary.json'
+    try:
+        with open(summary_file) as f:
+            days = json.load(f)['days']
+        if all(isinstance(day, dict) and {'date', 'captures', 'images'} <= day.keys() for day in days):
+            return days
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    
+    return None
 
-def generate_summary():
-    """Generate a summary report of all captured images"""
+def generate_summary(date_folder=None):
+    """Generate a summary report of all captured images
+    
+    When date_folder is given and summary.json already exists, only that
+    day's folder is rescanned; otherwise every date folder is scanned.
+    """
     
     if not OUTPUT_DIR.exists():
         return
     
+    days = load_summary_days() if date_folder else None
+    
+    if days is not None:
+        # Incremental update: rescan just the folder written by this capture
+        days = [day for day in days if day['date'] != date_folder]
+        date_dir = OUTPUT_DIR / date_folder
+        if date_dir.is_dir():
+            days.append(scan_date_dir(date_dir))
+        days.sort(key=lambda day: day['date'])
+    else:
+        days = []
+        for date_dir in sorted(OUTPUT_DIR.iterdir()):
+            # Skip hidden directories such as the API cache
+            if date_dir.is_dir() and not date_dir.name.startswith('.'):
+                days.append(scan_date_dir(date_dir))
+    
     summary = {
-        'last_updated': datetime.now(timezone(timedelta(hours=8))).isoformat(),
+        'last_updated': datetime.now(SGT).isoformat(),
         'timezone': 'Asia/Singapore (SGT)',
-        'total_days': 0,
-        'total_captures': 0,
-        'days': []
+        'total_days': len(days),
+        'total_captures': sum(day['captures'] for day in days),
+        'days': days
     }
     
-    for date_dir in sorted(OUTPUT_DIR.iterdir()):
-        if date_dir.is_dir():
-            metadata_files = list(date_dir.glob('metadata_*.json'))
-            image_files = list(date_dir.glob('camera_*.jpg'))
-            
-            summary['total_days'] += 1
-            summary['total_captures'] += len(metadata_files)
-            
-            summary['days'].append({
-                'date': date_dir.name,
-                'captures': len(metadata_files),
-                'images': len(image_files)
-            })
-    
     # Save summary
     summary_file = OUTPUT_DIR / 'summary.json'
-    with open(summary_file, 'w') as f:
-        json.dump(summary, indent=2, fp=f)
+    write_json(summary_file, summary)
     
     # Generate README
     generate_readme(summary)
 
+def strip_last_updated(readme_content):
+    """Drop the 'Last Updated' line so READMEs can be compared by content"""
+    
+    return ''.join(line for line in readme_content.splitlines(keepends=True)
+                   if not line.startswith('- **Last Updated**:'))
+
 def generate_readme(summary):
     """Generate a README file with capture history"""
     
-    readme_content = f"""# Singapore Checkpoint Traffic Monitor
+    parts = [f"""# Singapore Checkpoint Traffic Monitor
 
 Automated traffic monitoring for Singapore checkpoints (Tuas & Woodlands).
 
@@ -244,13 +486,14 @@ Automated traffic monitoring for Singapore checkpoints (Tuas & Woodlands).
 
 ## Recent Captures
 
-"""
+"""]
     
-    # Add recent days (last 7 days)
-    for day in sorted(summary['days'], key=lambda x: x['date'], reverse=True)[:7]:
-        readme_content += f"- **{day['date']}**: {day['captures']} capture(s), {day['images']} image(s)\n"
+    # Add recent days (last 7 days, newest first); generate_summary keeps
+    # summary['days'] in ascending date order, so no sort is needed
+    parts.extend(f"- **{day['date']}**: {day['captures']} capture(s), {day['images']} image(s)\n"
+                 for day in reversed(summary['days'][-7:]))
     
-    readme_content += """
+    parts.append("""
 
 ## Camera Locations
 
@@ -301,11 +544,24 @@ To analyze traffic patterns:
 ---
 
 *Automated by GitHub Actions - Captures at multiple times daily (Singapore Time)*
-"""
+""")
+    readme_content = "".join(parts)
     
     readme_file = OUTPUT_DIR / 'README.md'
+    
+    # Skip the write (and the resulting git change) when only the timestamp differs
+    try:
+        existing_content = readme_file.read_text()
+    except OSError:
+        existing_content = None
+    if existing_content is not None and strip_last_updated(existing_content) == strip_last_updated(readme_content):
+        return
+    
     with open(readme_file, 'w') as f:
         f.write(readme_content)
 
 if __name__ == '__main__':
-    capture_checkpoint_cameras()
+    summary_future = capture_checkpoint_cameras()
+    if summary_future is not None:
+        # Re-raises any error from generate_summary so the run exits non-zero
+        summary_future.result()